@@ -14,6 +14,7 @@ from .prices import electricity_charges_tou_demand
 from .dayanalysis import financial_year_ending
 from .dayanalysis import get_daily_usages, get_daily_charges
 from .monthanalysis import get_monthly_charges
+from .batch import price_records, price_files
 
 __all__ = [
     "__version__",
@@ -27,4 +28,6 @@ __all__ = [
     "get_daily_usages",
     "get_daily_charges",
     "get_monthly_charges",
+    "price_records",
+    "price_files",
 ]
@@ -0,0 +1,194 @@
+import asyncio
+import time
+from concurrent.futures import Executor
+from datetime import datetime
+from typing import NamedTuple
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Tuple
+from .rates import get_tariff_rates
+from .prices import electricity_charges_general
+from .prices import electricity_charges_tou
+from .prices import electricity_charges_tou_demand
+from .monthanalysis import MonthUsage, get_monthly_charges
+
+Records = Iterable[Tuple[datetime, datetime, float]]
+
+
+class BatchResult(NamedTuple):
+    """ Represents the priced result for a single input file """
+
+    path: str
+    months: Optional[Dict[Tuple[int, int], MonthUsage]]
+    charges: Optional[Dict[Tuple[int, int], Any]]
+    error: Optional[Exception]
+
+    def __repr__(self) -> str:
+        if self.error is not None:
+            return f"<BatchResult {self.path} failed>"
+        return f"<BatchResult {self.path} {len(self.charges)} months>"
+
+
+class BatchMetrics(NamedTuple):
+    """ Represents the throughput of a batch run
+
+    read_seconds and price_seconds are the time spent inside the reader and
+    pricing calls, summed across files, so with concurrency they can exceed
+    the elapsed wall time.
+    """
+
+    files: int
+    succeeded: int
+    failed: int
+    sink_failed: int
+    read_seconds: float
+    price_seconds: float
+    elapsed: float
+
+    @property
+    def files_per_second(self) -> float:
+        if not self.elapsed:
+            return 0.0
+        return self.files / self.elapsed
+
+    def __repr__(self) -> str:
+        return f"<BatchMetrics {self.succeeded}/{self.files} files {self.elapsed}s>"
+
+
+TARIFFS = ("t11", "t12", "t14")
+
+
+def price_records(
+    records: Records, retailer: str = "ergon", tariff: str = "t14", fy: str = "2017"
+) -> Tuple[Dict[Tuple[int, int], MonthUsage], Dict[Tuple[int, int], Any]]:
+    """ Get the monthly usages and the charges for each month
+
+    :param records: Tuple in the form of (billing_start, billing_end, usage)
+    :param retailer: Retailer config to get the rates from
+    :param tariff: Name of tariff from config (t11, t12 or t14)
+    :param fy: The financial year (ending) to get prices for
+    """
+    tariff = tariff.lower()
+    if tariff not in TARIFFS:
+        raise ValueError(f"Unsupported tariff {tariff}")
+    # Records are iterated more than once, so a generator would be exhausted
+    records = list(records)
+
+    months = get_monthly_charges(records, retailer, tariff, fy)
+    charges = {}
+    if tariff == "t11":
+        for month, usage in months.items():
+            charges[month] = electricity_charges_general(
+                retailer, usage.days, usage.total, fy
+            )
+    elif tariff == "t12":
+        for month, usage in months.items():
+            charges[month] = electricity_charges_tou(
+                retailer, usage.days, usage.peak, usage.shoulder, usage.offpeak, fy
+            )
+    else:
+        peak_months = get_tariff_rates(tariff, retailer, fy).tou_times.peak_months
+        for month, usage in months.items():
+            peak_season = month[1] in peak_months
+            charges[month] = electricity_charges_tou_demand(
+                retailer, usage.days, usage.total, usage.demand, fy, peak_season
+            )
+    return months, charges
+
+
+def _timed(func: Callable, *args: Any) -> Tuple[Any, float]:
+    """ Call a function and return its result with the seconds it took """
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+async def price_files(
+    paths: Iterable[str],
+    reader: Callable[[str], Records],
+    sink: Callable[[BatchResult], Awaitable[None]],
+    retailer: str = "ergon",
+    tariff: str = "t14",
+    fy: str = "2017",
+    concurrency: int = 4,
+    io_executor: Optional[Executor] = None,
+    cpu_executor: Optional[Executor] = None,
+) -> BatchMetrics:
+    """ Read and price a batch of meter files, streaming results to a sink
+
+    Each file is read in `io_executor` and priced in `cpu_executor`, so reading
+    one file overlaps with pricing another. A path is only taken from `paths`
+    once fewer than `concurrency` files are between being taken and the sink
+    returning, so a slow sink holds back further reads.
+    A file that fails to read or price is passed to the sink with its error,
+    and a sink that raises is counted in `sink_failed`; neither stops the batch.
+
+    :param paths: Paths of the files to price
+    :param reader: Reads a path and returns its usage records
+    :param sink: Coroutine function awaited with each BatchResult as it completes
+    :param retailer: Retailer config to get the rates from
+    :param tariff: Name of tariff from config (t11, t12 or t14)
+    :param fy: The financial year (ending) to get prices for
+    :param concurrency: Maximum number of files to work on at once
+    :param io_executor: Executor for reading files, defaults to the loop's
+    :param cpu_executor: Executor for pricing; use a ProcessPoolExecutor
+        (with a picklable reader output) to price on multiple cores
+    """
+    if concurrency < 1:
+        raise ValueError("concurrency must be at least 1")
+
+    loop = asyncio.get_event_loop()
+    slots = asyncio.Semaphore(concurrency)
+    stats = {"files": 0, "failed": 0, "sink_failed": 0, "read": 0.0, "price": 0.0}
+
+    async def process(path: str) -> None:
+        try:
+            try:
+                records, seconds = await loop.run_in_executor(
+                    io_executor, _timed, reader, path
+                )
+                stats["read"] += seconds
+                (months, charges), seconds = await loop.run_in_executor(
+                    cpu_executor, _timed, price_records, records, retailer, tariff, fy
+                )
+                stats["price"] += seconds
+                result = BatchResult(path, months, charges, None)
+            except Exception as e:
+                stats["failed"] += 1
+                result = BatchResult(path, None, None, e)
+            try:
+                await sink(result)
+            except Exception:
+                stats["sink_failed"] += 1
+        finally:
+            slots.release()
+
+    start_time = time.perf_counter()
+    tasks: set = set()
+    remaining = iter(paths)
+    try:
+        while True:
+            await slots.acquire()
+            try:
+                path = next(remaining)
+            except StopIteration:
+                slots.release()
+                break
+            stats["files"] += 1
+            task = loop.create_task(process(path))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    elapsed = time.perf_counter() - start_time
+
+    return BatchMetrics(
+        stats["files"],
+        stats["files"] - stats["failed"],
+        stats["failed"],
+        stats["sink_failed"],
+        stats["read"],
+        stats["price"],
+        elapsed,
+    )
@@ -0,0 +1,233 @@
+""" Test Suite
+"""
+
+import asyncio
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+import pytest
+from nemreader import read_nem_file
+import os
+import sys
+sys.path.insert(0, os.path.abspath(
+    os.path.join(os.path.dirname(__file__), '..')))
+
+import qldtariffs.batch
+from qldtariffs import get_monthly_charges, price_files, price_records
+
+
+def read_interval_readings(path):
+    return read_nem_file(path).readings['3044076134']['E1']
+
+
+def read_stub(path):
+    if path == 'missing':
+        raise OSError(path)
+    return [path]
+
+
+def price_stub(records, retailer, tariff, fy):
+    return {}, {'records': list(records)}
+
+
+@pytest.fixture
+def stub_pricing(monkeypatch):
+    """ Replace pricing so the pipeline is tested on its own """
+    monkeypatch.setattr(qldtariffs.batch, 'price_records', price_stub)
+
+
+def run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+def run_batch(paths, reader=read_stub, sink=None, **kwargs):
+    results = []
+
+    async def append_sink(result):
+        results.append(result)
+
+    metrics = run(price_files(paths, reader, sink or append_sink, **kwargs))
+    return results, metrics
+
+
+def test_price_records():
+    """ Test monthly charges for a set of records """
+    readings = read_interval_readings('examples/example_NEM12.csv')
+    months, charges = price_records(readings, 'ergon', 't14')
+    assert months == get_monthly_charges(readings, 'ergon', 't14', '2017')
+    assert sorted(charges) == sorted(months)
+    assert charges[(2016, 12)].total_charges.cost_incl_gst > 0
+
+
+def test_price_records_unknown_tariff():
+    """ Test an unsupported tariff is rejected """
+    with pytest.raises(ValueError):
+        price_records([], 'ergon', 't99')
+
+
+def test_price_files():
+    """ Test a batch of files is priced from generator readings """
+    path = 'examples/example_NEM12.csv'
+
+    def reader(path):
+        return (reading for reading in read_interval_readings(path))
+
+    results, metrics = run_batch([path] * 2, reader=reader, tariff='t12')
+    assert [result.error for result in results] == [None, None]
+    expected = price_records(read_interval_readings(path), 'ergon', 't12')
+    assert results[0].charges == expected[1]
+    assert metrics.succeeded == 2
+
+
+def test_price_files_errors(stub_pricing):
+    """ Test a bad file does not stop the rest of the batch """
+    results, metrics = run_batch(['a', 'missing'])
+    errors = {result.path: result.error for result in results}
+    assert errors['a'] is None
+    assert isinstance(errors['missing'], OSError)
+    assert metrics.files == 2
+    assert metrics.succeeded == 1
+    assert metrics.failed == 1
+    assert metrics.files_per_second > 0
+
+
+def test_price_files_concurrency():
+    """ Test concurrency must be positive """
+    with pytest.raises(ValueError):
+        run_batch([], concurrency=0)
+
+
+def test_price_files_sink_errors(stub_pricing):
+    """ Test a failing sink does not stop the rest of the batch """
+    results = []
+
+    async def sink(result):
+        results.append(result)
+        if len(results) == 1:
+            raise RuntimeError('sink failed')
+
+    _, metrics = run_batch(['a', 'b', 'c'], sink=sink)
+    assert len(results) == 3
+    assert metrics.succeeded == 3
+    assert metrics.sink_failed == 1
+
+
+def test_price_files_paths_error(stub_pricing):
+    """ Test an error from paths is raised without leaving tasks behind """
+
+    def paths():
+        yield 'a'
+        raise OSError('file drop unavailable')
+
+    async def sink(result):
+        pass
+
+    loop = asyncio.new_event_loop()
+    try:
+        with pytest.raises(OSError):
+            loop.run_until_complete(
+                price_files(paths(), read_stub, sink, concurrency=2))
+        all_tasks = getattr(asyncio, 'all_tasks', None) or asyncio.Task.all_tasks
+        assert not [task for task in all_tasks(loop) if not task.done()]
+    finally:
+        loop.close()
+
+
+def test_price_files_cancelled(stub_pricing):
+    """ Test cancelling the batch waits for the files in flight """
+    cleaned_up = []
+
+    async def check():
+        entered = asyncio.Event()
+
+        async def sink(result):
+            entered.set()
+            try:
+                await asyncio.Event().wait()
+            except asyncio.CancelledError:
+                await asyncio.sleep(0)
+                cleaned_up.append(result.path)
+                raise
+
+        # The second path waits for a free slot while the first is in the sink
+        batch = asyncio.ensure_future(
+            price_files(['a', 'b'], read_stub, sink, concurrency=1))
+        await entered.wait()
+        batch.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await batch
+        assert cleaned_up == ['a']
+
+    run(check())
+
+
+def test_price_files_in_flight(stub_pricing):
+    """ Test files are read concurrently but never above the limit """
+    lock = threading.Lock()
+    # Each reader waits for another so the test fails unless reads overlap
+    barrier = threading.Barrier(2, timeout=10)
+    in_flight = [0]
+    peak = [0]
+
+    def reader(path):
+        with lock:
+            in_flight[0] += 1
+            peak[0] = max(peak[0], in_flight[0])
+        try:
+            barrier.wait()
+            return read_stub(path)
+        finally:
+            with lock:
+                in_flight[0] -= 1
+
+    results, metrics = run_batch(['a', 'b', 'c', 'd'], reader=reader, concurrency=2)
+    assert metrics.succeeded == 4
+    assert peak[0] == 2
+
+
+def test_price_files_backpressure(stub_pricing):
+    """ Test a blocked sink stops further paths being taken """
+    concurrency = 2
+    pulled = [0]
+
+    def paths():
+        for i in range(10):
+            pulled[0] += 1
+            yield str(i)
+
+    async def check():
+        seen = asyncio.Event()
+        release = asyncio.Event()
+        sunk = []
+
+        async def sink(result):
+            sunk.append(result)
+            if len(sunk) == concurrency:
+                seen.set()
+            await release.wait()
+
+        batch = asyncio.ensure_future(
+            price_files(paths(), read_stub, sink, concurrency=concurrency))
+        await seen.wait()
+        await asyncio.sleep(0)
+        assert pulled[0] == concurrency
+        release.set()
+        return await batch
+
+    metrics = run(check())
+    assert pulled[0] == 10
+    assert metrics.succeeded == 10
+
+
+def test_price_files_process_pool(stub_pricing):
+    """ Test pricing in a process pool """
+    # Spawn rather than fork, as forking with executor threads alive can hang
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(2, mp_context=context) as executor:
+        results, metrics = run_batch(['a', 'b'], cpu_executor=executor)
+    assert metrics.succeeded == 2
+    assert sorted(result.charges['records'] for result in results) == [['a'], ['b']]